@@ -0,0 +1,282 @@
+"""
+Churn/coupling analysis and JSON encoding for the API.
+
+Kept free of I/O and fully annotated so it can be compiled to a C extension:
+
+    pip install mypy && mypyc api/_analysis.py
+
+The resulting _analysis.*.so sits next to this file and is picked up by the
+import in index.py ahead of the pure-Python source, which stays the fallback.
+"""
+import functools
+import itertools
+import json
+import os
+import sys
+from collections import Counter
+from typing import Any, Callable, Iterable, Iterator, Optional, Sequence, TypedDict
+
+# NumPy is optional, it only speeds up counting pairs of very large commits
+try:
+    import numpy as np
+except ImportError:
+    np = None  # type: ignore[assignment]
+
+# orjson encodes straight to bytes and is much faster, stdlib json is the fallback
+dumps: Callable[[Any], bytes]
+try:
+    import orjson
+    dumps = orjson.dumps
+except ImportError:
+    def _json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode('utf-8')
+    dumps = _json_dumps
+
+class FileMeta(TypedDict):
+    size: int # churn
+    createdAt: int
+    owner: str
+    group: str
+
+# Commits touching at least this many files have their pairs counted with NumPy
+NUMPY_MIN_FILES = 64
+# Pending pair codes are folded into the Counter once this many pile up
+NUMPY_MAX_PENDING = 8_000_000
+
+def _pair_codes(ids: list[int]) -> Any:
+    """
+    Encodes every (low, high) pair of a sorted id list as (low << 32) | high.
+    """
+    arr = np.asarray(ids, dtype=np.int64)
+    i, j = np.triu_indices(len(arr), 1)
+    return (arr[i] << 32) | arr[j]
+
+def _flush_pair_codes(couplings: "Counter[tuple[int, int]]", pair_codes: list[Any]) -> None:
+    """
+    Counts the pending pair codes in one vectorized pass and folds them into couplings.
+    """
+    codes, counts = np.unique(np.concatenate(pair_codes), return_counts=True)
+    pairs = zip((codes >> 32).tolist(), (codes & 0xFFFFFFFF).tolist())
+    couplings.update(dict(zip(pairs, counts.tolist())))
+    pair_codes.clear()
+
+def new_history_state() -> dict[str, Any]:
+    """
+    Empty accumulator state for analyze_history.
+    """
+    return {
+        "file_metadata": {}, # path -> {createdAt, size(churn), owner, group}
+        "couplings": Counter(), # (idA, idB) -> count, idA < idB
+        "path_ids": {}, # path -> int id, ids follow file_metadata insertion order
+        "all_files": set(), # every (unclustered) path seen so far
+        "clustered": False
+    }
+
+def analyze_history(commits: Sequence[dict[str, Any]], subpath: str = "", state: Optional[dict[str, Any]] = None) -> tuple[dict[str, FileMeta], "Counter[tuple[int, int]]"]:
+    """
+    Calculates churn and coupling.
+    Supports subpath filtering and relative clustering.
+    `commits` is walked twice, so it must be a list (or other sequence), not an iterator.
+    Pass a previous `state` to fold new commits into it instead of starting over.
+    """
+    if state is None:
+        state = new_history_state()
+    file_metadata: dict[str, FileMeta] = state["file_metadata"]
+    couplings: Counter[tuple[int, int]] = state["couplings"]
+    path_ids: dict[str, int] = state["path_ids"]
+    
+    # First pass: identify all files to check count
+    all_files: set[str] = state["all_files"]
+    for commit in commits:
+        files = [f for f in commit["files"] if not f.startswith('.git')]
+        if subpath:
+            # Filter by subpath (must start with subpath/)
+            # We add a trailing slash to subpath to ensure we match directories
+            prefix = subpath if subpath.endswith('/') else subpath + '/'
+            files = [f for f in files if f.startswith(prefix) or f == subpath]
+        all_files.update(files)
+        
+    # Smart Aggregation Logic
+    # If we have too many nodes (> 150) in this view, we cluster them by directory
+    USE_CLUSTERING = len(all_files) > 150
+    state["clustered"] = USE_CLUSTERING
+
+    pair_codes: list[Any] = [] # NumPy pair codes of large commits, not yet in couplings
+    pending = 0
+    
+    for commit in commits:
+        # Intern paths so dict/Counter key comparisons short-circuit on identity
+        files = [sys.intern(f) for f in commit["files"]]
+        timestamp = commit["timestamp"]
+        author = commit["author"]
+        
+        # Filter files - relaxed
+        files = [f for f in files if not f.startswith('.git/') and not f == '.git']
+        
+        if subpath:
+             prefix = subpath if subpath.endswith('/') else subpath + '/'
+             files = [f for f in files if f.startswith(prefix) or f == subpath]
+        
+        if not files:
+            continue
+        
+        if USE_CLUSTERING:
+            # Map files to their parent directories relative to subpath
+            # A dict rather than a set, so the order doesn't depend on PYTHONHASHSEED
+            clustered_files: dict[str, None] = {}
+            for f in files:
+                # Get path relative to current drill-down level
+                # e.g. subpath="src", f="src/ui/Button.tsx" -> rel="ui/Button.tsx"
+                if f == subpath:
+                    clustered_files[f] = None
+                    continue
+                    
+                rel_path = f[len(subpath):]
+                if rel_path.startswith('/'): rel_path = rel_path[1:]
+                
+                if '/' in rel_path:
+                    # It has a subdirectory, group by that
+                    top_dir = rel_path.split('/')[0]
+                    # Reconstruct full path for uniqueness
+                    full_cluster_path = f"{subpath}/{top_dir}" if subpath else top_dir
+                    clustered_files[full_cluster_path] = None
+                else:
+                    # It's a direct child file, keep it
+                    clustered_files[f] = None
+            
+            # Use the unique set of directories for this commit
+            files = list(clustered_files)
+
+        # Churn & Metadata (deduped so each file counts once per commit, in commit
+        # order so ids, node order and link direction are the same on every run)
+        ids: list[int] = []
+        for f in dict.fromkeys(files):
+            if f not in file_metadata:
+                path_ids[f] = len(path_ids)
+                file_metadata[f] = {
+                    "size": 1, # Initial size/churn
+                    "createdAt": timestamp,
+                    "owner": author,
+                    "group": get_file_type(f)
+                }
+            else:
+                file_metadata[f]["size"] += 1
+            ids.append(path_ids[f])
+        
+        # Coupling: sorted int ids give canonical (low, high) pairs
+        ids.sort()
+        if np is not None and len(ids) >= NUMPY_MIN_FILES:
+            # Interpreter overhead per pair dominates on big commits, vectorize those
+            pair_codes.append(_pair_codes(ids))
+            pending += len(pair_codes[-1])
+            if pending >= NUMPY_MAX_PENDING:
+                _flush_pair_codes(couplings, pair_codes)
+                pending = 0
+        else:
+            couplings.update(itertools.combinations(ids, 2))
+
+    if pair_codes:
+        _flush_pair_codes(couplings, pair_codes)
+
+    return file_metadata, couplings
+
+_EXT_MAP: dict[str, str] = {
+    '.py': 'PYTHON',
+    '.js': 'JS',
+    '.html': 'HTML',
+    '.css': 'CSS',
+    '.json': 'JSON',
+    '.md': 'DOCS',
+    '.txt': 'TEXT',
+    '.c': 'C',
+    '.cpp': 'CPP',
+    '.h': 'HEADER',
+    '.java': 'JAVA',
+    '.go': 'GO',
+    '.rs': 'RUST',
+    '.ts': 'TS',
+    '.jsx': 'REACT',
+    '.tsx': 'REACT'
+}
+
+@functools.lru_cache(maxsize=4096)
+def _type_for_ext(ext: str) -> str:
+    """
+    Maps a (case-insensitive) extension to its file type.
+    """
+    return _EXT_MAP.get(ext.lower(), 'OTHER')
+
+def get_file_type(filepath: str) -> str:
+    """
+    Determines file type based on extension.
+    """
+    ext = os.path.splitext(filepath)[1]
+    # If no extension, assume it's a folder or special file
+    if not ext:
+        # Heuristic: Uppercase usually Makefile, LICENSE, etc.
+        # Lowercase usually folder
+        if os.path.basename(filepath).isupper():
+            return 'CONFIG'
+        return 'FOLDER'
+        
+    return _type_for_ext(ext)
+
+def _join_chunks(items: Iterable[bytes], chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    Joins encoded JSON values with commas into chunks of roughly chunk_size bytes.
+    """
+    buf: list[bytes] = []
+    size = 0
+    sep = b''
+    for item in items:
+        buf.append(sep)
+        buf.append(item)
+        sep = b','
+        size += len(item) + 1
+        if size >= chunk_size:
+            yield b''.join(buf)
+            buf = []
+            size = 0
+    if buf:
+        yield b''.join(buf)
+
+def iter_json(file_metadata: dict[str, FileMeta], couplings: "Counter[tuple[int, int]]") -> Iterator[bytes]:
+    """
+    Generates the final JSON structure as a stream of UTF-8 chunks,
+    so the response can start before every node and link is serialized.
+    """
+    def nodes() -> Iterator[bytes]:
+        for f, meta in file_metadata.items():
+            # Frontend expects 'label' and 'type'
+            # Group is used for color/grouping, type is used for display
+            group = meta["group"]
+            yield dumps({
+                "id": f,
+                "label": f, # Use filename as label
+                "group": group,
+                "type": group,
+                "size": meta["size"],
+                "owner": meta["owner"],
+                "createdAt": meta["createdAt"]
+            })
+
+    def links() -> Iterator[bytes]:
+        # Coupling ids index file_metadata in insertion order
+        paths = list(file_metadata)
+        metas = list(file_metadata.values())
+        for (source_id, target_id), weight in couplings.items():
+            # Check weight usage (only include if > 1 to reduce noise? optional)
+            if weight >= 1:
+                link_time = max(metas[source_id]["createdAt"], metas[target_id]["createdAt"])
+                yield dumps({
+                    "source": paths[source_id],
+                    "target": paths[target_id],
+                    "weight": weight,
+                    "createdAt": link_time
+                })
+
+    yield b'{"nodes":['
+    yield from _join_chunks(nodes())
+    yield b'],"links":['
+    yield from _join_chunks(links())
+    yield b']}'
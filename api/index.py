@@ -1,11 +1,17 @@
-import json
+import hashlib
+import multiprocessing
 import os
+import pickle
 import sys
 import tempfile
 import shutil
-from collections import defaultdict, Counter
-from datetime import datetime
-from http.server import BaseHTTPRequestHandler
+import stat
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from operator import itemgetter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import urlparse, parse_qs
 
 # Import Dulwich safely
@@ -13,7 +19,6 @@ try:
     from dulwich import porcelain
     from dulwich.repo import Repo
     from dulwich.diff_tree import tree_changes
-    from dulwich.objects import Tree
     DULWICH_AVAILABLE = True
     DULWICH_ERROR = None
 except ImportError:
@@ -22,277 +27,479 @@ except ImportError:
         from dulwich import porcelain
         from dulwich.repo import Repo
         from dulwich.diff import tree_changes
-        from dulwich.objects import Tree
         DULWICH_AVAILABLE = True
         DULWICH_ERROR = None
     except ImportError as e:
         DULWICH_AVAILABLE = False
         DULWICH_ERROR = str(e)
 
-def get_commits(repo_path):
+# Vercel loads this file by path, make the sibling _analysis module importable
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _analysis import analyze_history, dumps, iter_json, new_history_state
+
+# We use depth=500 to avoid disk space issues on Vercel with large repos
+CLONE_DEPTH = 500
+
+def clone_repo(repo_url, temp_dir):
+    """
+    Clones commit and tree objects only (no blobs, no checkout) to temp_dir.
+    Uses the git binary when present, Dulwich otherwise.
+    """
+    if not is_allowed_repo_url(repo_url):
+        raise ValueError(f"Unsupported repository URL: {repo_url!r}")
+    if shutil.which("git"):
+        subprocess.run([
+            "git",
+            "clone",
+            "--filter=blob:none", # Don't download file contents
+            "--no-checkout",      # Don't check out files to disk
+            f"--depth={CLONE_DEPTH}",
+            "--",                 # Nothing after this is parsed as an option
+            repo_url,
+            temp_dir
+        ], check=True, timeout=120)
+    else:
+        # usage: porcelain.clone(source, target, bare=False, checkout=False, depth=None)
+        porcelain.clone(repo_url, temp_dir, depth=CLONE_DEPTH)
+
+TEMP_DIR_PREFIX = "obsidigit-clone-"
+# Clone dirs older than this are assumed abandoned by a previous process
+STALE_TEMP_DIR_SECONDS = 60 * 60
+
+def on_rm_error(func, path, exc_info):
+    try:
+        os.chmod(path, 0o777)
+        func(path)
+    except: pass
+
+def remove_temp_dir(temp_dir):
+    """
+    Deletes a clone directory, forcing read-only pack files.
+    """
+    shutil.rmtree(temp_dir, onerror=on_rm_error)
+
+def reap_stale_temp_dirs():
+    """
+    Removes clone dirs a previous process never got to delete
+    (killed mid-request, or frozen before its background delete ran).
+    """
+    cutoff = time.time() - STALE_TEMP_DIR_SECONDS
+    try:
+        entries = list(os.scandir(tempfile.gettempdir()))
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.name.startswith(TEMP_DIR_PREFIX) and entry.is_dir(follow_symlinks=False) and entry.stat().st_mtime < cutoff:
+                remove_temp_dir(entry.path)
+        except OSError:
+            pass
+
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "obsidigit-cache")
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+def is_allowed_repo_url(repo_url):
+    """
+    Only https:// and scp-style git@host:path URLs are accepted. Anything else
+    (local paths, ext::, and above all values starting with "-", which git would
+    read as options such as --upload-pack) is refused before git is run.
+    """
+    if repo_url.startswith("-"):
+        return False
+    if repo_url.startswith("https://"):
+        return True
+    # git@host:path, the host goes to ssh and must not look like an option either
+    return repo_url.startswith("git@") and not repo_url[len("git@"):].startswith("-")
+
+def get_remote_head(repo_url):
+    """
+    Resolves the remote HEAD sha with a lightweight ls-remote.
+    Returns None when it can't be determined (caching is then skipped).
+    """
+    if not shutil.which("git") or not is_allowed_repo_url(repo_url):
+        return None
+    try:
+        # "--" so the URL can never be parsed as an option
+        result = subprocess.run(["git", "ls-remote", "--", repo_url, "HEAD"], capture_output=True, text=True, timeout=30)
+    except Exception:
+        return None
+    if result.returncode != 0 or not result.stdout:
+        return None
+    return result.stdout.split()[0]
+
+def get_cache_path(repo_url, head, subpath):
+    """
+    Path of the cached JSON response for a (repo, HEAD, subpath) triple.
+    """
+    key = hashlib.sha256(f"{repo_url}|{head}|{subpath}".encode('utf-8')).hexdigest()
+    return os.path.join(CACHE_DIR, f"{key}.json")
+
+def read_cache(cache_path):
+    """
+    Returns the cached response bytes, or None on a miss.
+    """
+    try:
+        with open(cache_path, 'rb') as f:
+            body = f.read()
+    except OSError:
+        return None
+    # Bump mtime so the LRU trim keeps recently served entries
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+    return body
+
+def cache_chunks(cache_path, chunks):
+    """
+    Passes response chunks through while writing them to the cache.
+    The entry is published atomically once the whole body has been seen.
+    """
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    except OSError as e:
+        print(f"Cache write error: {e}")
+        yield from chunks
+        return
+
+    f = os.fdopen(fd, 'wb')
+    try:
+        for chunk in chunks:
+            if f:
+                try:
+                    f.write(chunk)
+                except OSError as e:
+                    # The cache is best-effort, never fail the request over it
+                    print(f"Cache write error: {e}")
+                    f.close()
+                    f = None
+            yield chunk
+        if f:
+            f.close()
+            f = None
+            os.replace(tmp_path, cache_path)
+            trim_cache()
+    finally:
+        # Aborted (client went away, write error): drop the partial entry
+        if f:
+            f.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def trim_cache(cache_dir=CACHE_DIR, suffix='.json', max_bytes=CACHE_MAX_BYTES):
+    """
+    Trims a cache directory back under max_bytes by evicting the least recently used entries.
+    """
+    try:
+        entries = []
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith(suffix):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            os.remove(path)
+            total -= size
+    except OSError as e:
+        print(f"Cache trim error: {e}")
+
+STATE_DIR = os.path.join(tempfile.gettempdir(), "obsidigit-state")
+STATE_MAX_BYTES = 256 * 1024 * 1024
+# Bump whenever the shape of the persisted state changes
+STATE_VERSION = 3
+
+def state_dir_is_private():
+    """
+    True if STATE_DIR is a real directory owned by us and closed to everyone else.
+    The temp dir is world-writable and the file names are predictable, so
+    anything else could hold pickles planted by another user.
+    """
+    try:
+        st = os.lstat(STATE_DIR)
+    except OSError:
+        return False
+    if not stat.S_ISDIR(st.st_mode):
+        return False
+    if hasattr(os, "getuid") and (st.st_uid != os.getuid() or st.st_mode & 0o077):
+        return False
+    return True
+
+def get_state_path(repo_url, subpath):
+    """
+    Path of the persisted analysis state for a (repo, subpath) pair.
+    """
+    key = hashlib.sha256(f"{STATE_VERSION}|{repo_url}|{subpath}".encode('utf-8')).hexdigest()
+    return os.path.join(STATE_DIR, f"{key}.pkl")
+
+def load_state(state_path):
+    """
+    Loads a previously saved analysis state, or None if there isn't a usable one.
+    """
+    if not state_dir_is_private():
+        return None
+    try:
+        with open(state_path, 'rb') as f:
+            state = pickle.load(f)
+    except Exception:
+        return None
+    # Bump mtime so the LRU trim keeps recently used states
+    try:
+        os.utime(state_path)
+    except OSError:
+        pass
+    return state
+
+def save_state(state_path, state):
+    """
+    Atomically persists the analysis state.
+    """
+    try:
+        os.makedirs(STATE_DIR, mode=0o700, exist_ok=True)
+        st = os.lstat(STATE_DIR)
+        if stat.S_ISDIR(st.st_mode) and hasattr(os, "getuid") and st.st_uid == os.getuid() and st.st_mode & 0o077:
+            # Ours but created by an older version with the default mode, tighten it
+            os.chmod(STATE_DIR, 0o700)
+        if not state_dir_is_private():
+            print(f"State write error: {STATE_DIR} is not private to this user")
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=STATE_DIR, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, state_path)
+    except OSError as e:
+        print(f"State write error: {e}")
+        return
+    trim_cache(STATE_DIR, '.pkl', STATE_MAX_BYTES)
+
+_worker_repo = None
+_path_cache = {} # raw Dulwich path (bytes) -> decoded, interned str
+
+def _init_worker(repo_path):
+    """
+    Opens the Repo handle used by _extract_commit in this process.
+    """
+    global _worker_repo
+    _worker_repo = Repo(repo_path)
+    _path_cache.clear()
+
+def _extract_commit(indexed_job):
+    """
+    Pool entry point, runs _diff_commit against this worker's Repo.
+    Takes and returns the job's walk index alongside, results come back unordered.
+    """
+    walk_index, job = indexed_job
+    return walk_index, _diff_commit(_worker_repo, job, _path_cache)
+
+def _diff_commit(repo, job, path_cache):
+    """
+    Computes the changed files and metadata of a single commit.
+    `job` is (commit_id, parent_tree_id, current_tree_id), with the parent tree
+    already resolved by get_commits (None for a root commit).
+    """
+    commit_id, parent_tree_id, current_tree_id = job
+    commit = repo[commit_id]
+
+    files = []
+    
+    if parent_tree_id == current_tree_id:
+        # Same tree as the parent (empty commits, some merges and reverts):
+        # nothing changed, don't walk both trees to find that out
+        changes = ()
+    else:
+        # tree_changes(store, tree1_id, tree2_id)
+        # Passing None for tree1_id makes dulwich treat it as an empty tree,
+        # so we never need to look up the (possibly missing) empty tree object.
+        changes = tree_changes(repo.object_store, parent_tree_id, current_tree_id, want_unchanged=False)
+    
+    for change in changes:
+        # We want the filename. 
+        # change.new is None for deletions, change.old is None for creations.
+        # If both exist (modify), we use new path.
+        fpath = None
+        if change.new and change.new.path:
+            fpath = change.new.path
+        elif change.old and change.old.path:
+            fpath = change.old.path
+            
+        if fpath:
+            # Dulwich paths are bytes, decode each unique path only once
+            path = path_cache.get(fpath)
+            if path is None:
+                path = sys.intern(fpath.decode('utf-8', 'replace'))
+                path_cache[fpath] = path
+            files.append(path)
+
+    # Parse author (Format: b"Name <email>")
+    try:
+        author = commit.author.decode('utf-8', errors='replace')
+    except:
+        author = str(commit.author)
+        
+    if '<' in author:
+        author = author.split('<')[0].strip()
+
+    # Parse subject
+    try:
+        subject = commit.message.decode('utf-8', errors='replace').split('\n')[0]
+    except:
+        subject = "No Subject"
+
+    return {
+        "hash": commit.id.decode('utf-8'),
+        "timestamp": commit.commit_time,
+        "author": author,
+        "subject": subject,
+        "files": files
+    }
+
+# One worker pool at a time: each pool already uses every core, and with
+# ThreadingHTTPServer concurrent requests would otherwise multiply the process count
+_POOL_SLOT = threading.BoundedSemaphore(1)
+
+def get_commits(repo_path, exclude=None):
     """
     Retrieves commit history using Dulwich.
+    Commits are diffed in parallel, one Repo handle per worker process.
+    `exclude` stops the walk at the given commit ids (e.g. an already analyzed HEAD).
     """
     if not DULWICH_AVAILABLE: return []
     
     repo = Repo(repo_path)
-    commits = []
     
     # Get walker (iterates from most recent backwards)
     try:
-        walker = repo.get_walker()
+        # No paths= filter for subpaths: Dulwich would also drop merges that
+        # match one parent (history simplification), so drill-down counts would
+        # differ from the root view. analyze_history drops files outside subpath.
+        walker = repo.get_walker(exclude=exclude)
     except Exception as e:
         print(f"Walker error: {e}")
         return []
     
-    # Convert to list and reverse to get chronological order (oldest first)
-    all_commits = list(walker)
-    all_commits.reverse()
-    
-    empty_tree_id = Tree().id
+    def commit_jobs():
+        # Stream (walk_index, (commit_id, parent_tree_id, tree_id)) jobs straight from the walker.
+        # Every walked commit's tree id is remembered, so a parent is only
+        # read from the object store if the walk never reaches it.
+        tree_by_id = {}
+        waiting = defaultdict(list) # parent id -> [(walk index, child id, child tree id)]
+        for walk_index, entry in enumerate(walker):
+            # dulwich.walker.Walker returns WalkEntry objects
+            # We need to get the actual commit object
+            try:
+                commit = entry.commit
+            except AttributeError:
+                # Fallback if it's already a commit object (older versions?)
+                commit = entry
+            tree_by_id[commit.id] = commit.tree
+
+            # The walker yields children first, release the ones waiting on this commit
+            for child_index, child_id, child_tree_id in waiting.pop(commit.id, ()):
+                yield child_index, (child_id, commit.tree, child_tree_id)
+
+            # get_parents honours .git/shallow, so the oldest commits of a
+            # depth-limited clone have none even though commit.parents is set
+            parents = repo.get_parents(commit.id, commit)
+            if not parents and commit.parents:
+                # Shallow boundary: the parent was cut off, diffing against an
+                # empty tree would list every file and couple them all. Skip it,
+                # its tree is still recorded above for its children.
+                continue
+            if not parents:
+                # Initial commit: diff against empty tree.
+                # However, in partial clones, the empty tree object might not exist.
+                # We use None to indicate "new root".
+                yield walk_index, (commit.id, None, commit.tree)
+            elif parents[0] in tree_by_id:
+                yield walk_index, (commit.id, tree_by_id[parents[0]], commit.tree)
+            else:
+                waiting[parents[0]].append((walk_index, commit.id, commit.tree))
+
+        # Parents outside the walk (excluded)
+        for parent_id, children in waiting.items():
+            parent_tree_id = repo[parent_id].tree
+            for child_index, child_id, child_tree_id in children:
+                yield child_index, (child_id, parent_tree_id, child_tree_id)
     
-    for entry in all_commits:
-        # dulwich.walker.Walker returns WalkEntry objects
-        # We need to get the actual commit object
+    with _POOL_SLOT:
         try:
-            commit = entry.commit
-        except AttributeError:
-            # Fallback if it's already a commit object (older versions?)
-            commit = entry
+            pool = multiprocessing.Pool(processes=os.cpu_count(), initializer=_init_worker, initargs=(repo_path,))
+        except OSError:
+            # Some sandboxes (e.g. AWS Lambda) have no /dev/shm for the pool's semaphores
+            pool = None
 
-        files = []
-        
-        # Determine parent tree for diff
-        if commit.parents:
-            parent_tree_id = repo[commit.parents[0]].tree
+        if pool is None:
+            # Local repo and memo rather than the worker globals: requests may run concurrently
+            path_cache = {}
+            results = [(walk_index, _diff_commit(repo, job, path_cache)) for walk_index, job in commit_jobs()]
         else:
-            # Initial commit: diff against empty tree.
-            # However, in partial clones, the empty tree object might not exist.
-            # We can use None to indicate "new root".
-             parent_tree_id = None
+            with pool:
+                results = list(pool.imap_unordered(_extract_commit, commit_jobs(), chunksize=64))
+    
+    # The walker yields newest first and workers finish out of order: put the
+    # results back in reverse walk order (oldest first). Sorting by timestamp
+    # alone would leave commits with equal timestamps newest first.
+    results.sort(key=itemgetter(0), reverse=True)
+    commits = [commit for _, commit in results]
             
-        current_tree_id = commit.tree
-        
-        # Get changes
-        if parent_tree_id is None:
-             # If no parent, we simply walk the current tree recursively
-             # But tree_changes requires two trees.
-             # Alternative: use repo.object_store.tree_changes with empty_tree_id ONLY if it exists?
-             # Or construct a virtual empty tree?
-             # Actually diff_tree.tree_changes handles None as "empty" usually, let's verify.
-             # Inspecting dulwich source, tree_changes(store, tree1, tree2)
-             # If tree1 is None, it should treat as empty.
-             pass
-             
-        # tree_changes(store, tree1_id, tree2_id)
-        # If we pass None for tree1_id, does dulwich handle it?
-        # Based on error, it tried to lookup empty_tree_id and failed.
-        # Let's see if we can pass None.
-        
-        changes = tree_changes(repo.object_store, parent_tree_id, current_tree_id)
-        
-        for change in changes:
-            # We want the filename. 
-            # change.new is None for deletions, change.old is None for creations.
-            # If both exist (modify), we use new path.
-            fpath = None
-            if change.new and change.new.path:
-                fpath = change.new.path
-            elif change.old and change.old.path:
-                fpath = change.old.path
-                
-            if fpath:
-                # Dulwich paths are bytes
-                try:
-                    files.append(fpath.decode('utf-8'))
-                except:
-                    files.append(str(fpath))
+    return commits
 
-        # Parse author (Format: b"Name <email>")
-        try:
-            author = commit.author.decode('utf-8', errors='replace')
-        except:
-            author = str(commit.author)
-            
-        if '<' in author:
-            author = author.split('<')[0].strip()
+def run_analysis(repo_path, repo_url, subpath):
+    """
+    Analyzes the cloned repo, only walking commits added since the last
+    saved state for this repo/subpath when possible.
+    """
+    repo = Repo(repo_path)
+    head = repo.head()
+    state_path = get_state_path(repo_url, subpath)
+    state = load_state(state_path)
 
-        # Parse subject
-        try:
-            subject = commit.message.decode('utf-8', errors='replace').split('\n')[0]
-        except:
-            subject = "No Subject"
-
-        commits.append({
-            "hash": commit.id.decode('utf-8'),
-            "timestamp": commit.commit_time,
-            "author": author,
-            "subject": subject,
-            "files": files
-        })
-            
-    return commits
+    if state and state["head"] != head:
+        if state["head"] in repo:
+            # Fold only the new commits (last_head..HEAD) into the stored counters
+            was_clustered = state["clustered"]
+            commits = get_commits(repo_path, exclude=[state["head"]])
+            analyze_history(commits, subpath, state)
+            if state["clustered"] != was_clustered:
+                # Crossed the clustering threshold, so the folded counts mix
+                # raw and clustered paths: start over
+                state = None
+        else:
+            # History was rewritten (or fell outside the clone depth)
+            state = None
+
+    if state is None:
+        state = new_history_state()
+        commits = get_commits(repo_path)
+        analyze_history(commits, subpath, state)
+
+    if state.get("head") != head:
+        state["head"] = head
+        save_state(state_path, state)
+
+    return state["file_metadata"], state["couplings"]
+
+_reaper_lock = threading.Lock()
+_reaper_started = False
 
-def analyze_history(commits, subpath=""):
+def start_reaper():
     """
-    Calculates churn and coupling.
-    Supports subpath filtering and relative clustering.
+    Starts the stale clone reaper once per process, off the request path.
+    Called from the first request rather than at import, so pool workers
+    importing this module don't each start one.
     """
-    file_metadata = {} # path -> {createdAt, size(churn), owner}
-    couplings = Counter() # (fileA, fileB) -> count
-    
-    # First pass: identify all files to check count
-    all_files = set()
-    for commit in commits:
-        files = [f for f in commit["files"] if not f.startswith('.git')]
-        if subpath:
-            # Filter by subpath (must start with subpath/)
-            # We add a trailing slash to subpath to ensure we match directories
-            prefix = subpath if subpath.endswith('/') else subpath + '/'
-            files = [f for f in files if f.startswith(prefix) or f == subpath]
-        all_files.update(files)
-        
-    # Smart Aggregation Logic
-    # If we have too many nodes (> 150) in this view, we cluster them by directory
-    USE_CLUSTERING = len(all_files) > 150
-    
-    for commit in commits:
-        files = commit["files"]
-        timestamp = commit["timestamp"]
-        author = commit["author"]
-        
-        # Filter files - relaxed
-        files = [f for f in files if not f.startswith('.git/') and not f == '.git']
-        
-        if subpath:
-             prefix = subpath if subpath.endswith('/') else subpath + '/'
-             files = [f for f in files if f.startswith(prefix) or f == subpath]
-        
-        if not files:
-            continue
-        
-        if USE_CLUSTERING:
-            # Map files to their parent directories relative to subpath
-            clustered_files = set()
-            for f in files:
-                # Get path relative to current drill-down level
-                # e.g. subpath="src", f="src/ui/Button.tsx" -> rel="ui/Button.tsx"
-                if f == subpath:
-                    clustered_files.add(f)
-                    continue
-                    
-                rel_path = f[len(subpath):]
-                if rel_path.startswith('/'): rel_path = rel_path[1:]
-                
-                if '/' in rel_path:
-                    # It has a subdirectory, group by that
-                    top_dir = rel_path.split('/')[0]
-                    # Reconstruct full path for uniqueness
-                    full_cluster_path = f"{subpath}/{top_dir}" if subpath else top_dir
-                    clustered_files.add(full_cluster_path)
-                else:
-                    # It's a direct child file, keep it
-                    clustered_files.add(f)
-            
-            # Use the unique set of directories for this commit
-            files = list(clustered_files)
-
-        # Churn & Metadata
-        for f in files:
-            if f not in file_metadata:
-                file_metadata[f] = {
-                    "size": 1, # Initial size/churn
-                    "createdAt": timestamp,
-                    "owner": author
-                }
-            else:
-                file_metadata[f]["size"] += 1
-        
-        # Coupling
-        if len(files) > 1:
-            for i in range(len(files)):
-                for j in range(i + 1, len(files)):
-                    f1 = files[i]
-                    f2 = files[j]
-                    # Sort pair to ensure (A, B) is same as (B, A)
-                    pair = tuple(sorted((f1, f2)))
-                    couplings[pair] += 1
-
-    return file_metadata, couplings
-
-def get_file_type(filepath):
-    """
-    Determines file type based on extension.
-    """
-    ext = os.path.splitext(filepath)[1].lower()
-    mapping = {
-        '.py': 'PYTHON',
-        '.js': 'JS',
-        '.html': 'HTML',
-        '.css': 'CSS',
-        '.json': 'JSON',
-        '.md': 'DOCS',
-        '.txt': 'TEXT',
-        '.c': 'C',
-        '.cpp': 'CPP',
-        '.h': 'HEADER',
-        '.java': 'JAVA',
-        '.go': 'GO',
-        '.rs': 'RUST',
-        '.ts': 'TS',
-        '.jsx': 'REACT',
-        '.tsx': 'REACT'
-    }
-    # If no extension, assume it's a folder or special file
-    if not ext:
-        # Heuristic: Uppercase usually Makefile, LICENSE, etc.
-        # Lowercase usually folder
-        if os.path.basename(filepath).isupper():
-            return 'CONFIG'
-        return 'FOLDER'
-        
-    return mapping.get(ext, 'OTHER')
-
-def generate_json(file_metadata, couplings):
-    """
-    Generates the final JSON structure.
-    """
-    formatted_nodes = []
-    for f, meta in file_metadata.items():
-        # Frontend expects 'label' and 'type'
-        # Group is used for color/grouping, type is used for display
-        group = get_file_type(f)
-        formatted_nodes.append({
-            "id": f,
-            "label": f, # Use filename as label
-            "group": group,
-            "type": group,
-            "size": meta["size"],
-            "owner": meta["owner"],
-            "createdAt": meta["createdAt"]
-        })
-
-    links = []
-    for pair, weight in couplings.items():
-        source, target = pair
-        if source in file_metadata and target in file_metadata:
-            # Check weight usage (only include if > 1 to reduce noise? optional)
-            if weight >= 1:
-                link_time = max(file_metadata[source]["createdAt"], file_metadata[target]["createdAt"])
-                links.append({
-                    "source": source,
-                    "target": target,
-                    "weight": weight,
-                    "createdAt": link_time
-                })
-            
-    return {
-        "nodes": formatted_nodes,
-        "links": links
-    }
+    global _reaper_started
+    with _reaper_lock:
+        if _reaper_started:
+            return
+        _reaper_started = True
+    threading.Thread(target=reap_stale_temp_dirs, daemon=True).start()
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
+        start_reaper()
         try:
             parsed = urlparse(self.path)
             params = parse_qs(parsed.query)
@@ -310,72 +517,90 @@ class handler(BaseHTTPRequestHandler):
                 self.send_response(status)
                 self.send_header('Content-type', 'application/json')
                 self.end_headers()
-                self.wfile.write(json.dumps(data).encode('utf-8'))
+                self.wfile.write(dumps(data))
+                return
+
+            if not is_allowed_repo_url(repo_url):
+                self.send_response(400)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(dumps({"error": "Unsupported repository URL, use an https:// or git@ URL."}))
                 return
 
             if not DULWICH_AVAILABLE:
                 self.send_response(500)
                 self.send_header('Content-type', 'application/json')
                 self.end_headers()
-                self.wfile.write(json.dumps({"error": f"Dulwich (git) library missing: {DULWICH_ERROR}. Check server logs."}).encode('utf-8'))
+                self.wfile.write(dumps({"error": f"Dulwich (git) library missing: {DULWICH_ERROR}. Check server logs."}))
                 return
 
+            # Serve straight from disk if this exact HEAD was analyzed before
+            cache_path = None
+            head = get_remote_head(repo_url)
+            if head:
+                cache_path = get_cache_path(repo_url, head, subpath)
+                body = read_cache(cache_path)
+                if body is not None:
+                    self.send_response(200)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+
             temp_dir = None
+            headers_sent = False
             try:
-                temp_dir = tempfile.mkdtemp()
+                temp_dir = tempfile.mkdtemp(prefix=TEMP_DIR_PREFIX)
                 
-                # Clone using Dulwich
-                # supports https://...
-                # usage: porcelain.clone(source, target, bare=False, checkout=False, depth=None)
-                # We use depth=500 to avoid disk space issues on Vercel with large repos
-                # print(f"Cloning {repo_url} with depth 500...")
-                porcelain.clone(repo_url, temp_dir, depth=500)
+                clone_repo(repo_url, temp_dir)
                 
-                commits = get_commits(temp_dir)
-                repo_url = params.get('url', [None])[0]
-                subpath = params.get('subpath', [""])[0]
-                # Clean subpath
-                if subpath and subpath.endswith('/'): subpath = subpath[:-1]
-
-                # ... (rest of code)
-                
-                # Clone using Dulwich
-                # supports https://...
-                # usage: porcelain.clone(source, target, bare=False, checkout=False, depth=None)
-                # We use depth=500 to avoid disk space issues on Vercel with large repos
-                # print(f"Cloning {repo_url} with depth 500...")
-                porcelain.clone(repo_url, temp_dir, depth=500)
-                
-                commits = get_commits(temp_dir)
-                file_metadata, couplings = analyze_history(commits, subpath)
-                data = generate_json(file_metadata, couplings)
+                file_metadata, couplings = run_analysis(temp_dir, repo_url, subpath)
+                chunks = iter_json(file_metadata, couplings)
+                if cache_path:
+                    chunks = cache_chunks(cache_path, chunks)
 
+                # No Content-Length: the body is streamed as it is serialized
                 self.send_response(200)
                 self.send_header('Content-type', 'application/json')
                 self.end_headers()
-                self.wfile.write(json.dumps(data).encode('utf-8'))
+                headers_sent = True
+                for chunk in chunks:
+                    self.wfile.write(chunk)
 
             except Exception as e:
-                # Try to send error if headers not sent
-                try:
+                if headers_sent:
+                    # The 200 and part of the body are already out, a second response
+                    # would only corrupt it. Log and drop the connection, the client
+                    # sees a truncated body instead of bogus JSON.
+                    self.log_error("Analysis failed mid-response: %s", e)
+                    self.close_connection = True
+                else:
                     self.send_response(500)
-                except: pass
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"error": f"Analysis failed: {str(e)}"}).encode('utf-8'))
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(dumps({"error": f"Analysis failed: {str(e)}"}))
             
             finally:
                 if temp_dir and os.path.exists(temp_dir):
-                    def on_rm_error(func, path, exc_info):
-                        try:
-                            os.chmod(path, 0o777)
-                            func(path)
-                        except: pass
-                    shutil.rmtree(temp_dir, onerror=on_rm_error)
+                    # The response is already written, don't make the client wait for the delete
+                    threading.Thread(target=remove_temp_dir, args=(temp_dir,), daemon=True).start()
         except Exception as outer_e:
             try:
                  self.send_response(500)
                  self.send_header('Content-type', 'application/json')
                  self.end_headers()
-                 self.wfile.write(json.dumps({"error": f"Server error: {str(outer_e)}"}).encode('utf-8'))
+                 self.wfile.write(dumps({"error": f"Server error: {str(outer_e)}"}))
             except: pass
+
+if __name__ == "__main__":
+    # Local server. Vercel calls `handler` directly, one request per instance;
+    # here each request gets its own thread so a slow clone doesn't block the rest.
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        # Pools are started from request threads, and forking a multi-threaded process
+        # can deadlock on locks other threads hold. forkserver forks workers from a
+        # clean single-threaded server process instead (it re-imports this module,
+        # which is safe here behind the __main__ guard).
+        multiprocessing.set_start_method("forkserver")
+    port = int(os.environ.get("PORT", "8000"))
+    print(f"Serving on http://localhost:{port}/api")
+    ThreadingHTTPServer(("", port), handler).serve_forever()
@@ -1,37 +1,106 @@
 import subprocess
+import itertools
 import json
+import math
 import os
+import pickle
+import random
 import sys
 import argparse
+import functools
 import tempfile
 import shutil
-from collections import defaultdict, Counter
+from array import array
+from collections import namedtuple, Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 
-def run_git_log(repo_path):
+# orjson encodes straight to bytes and is much faster, stdlib json is the fallback
+try:
+    import orjson
+    dumps = orjson.dumps
+except ImportError:
+    def dumps(obj):
+        return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+# pygit2 is optional: with it local history is walked in-process through libgit2
+# instead of parsing git log output
+try:
+    import pygit2
+    PYGIT2_ERRORS = (pygit2.GitError,)
+except ImportError:
+    pygit2 = None
+    PYGIT2_ERRORS = ()
+
+# NumPy + SciPy are optional: with them coupling is one sparse matrix product
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = None
+    sparse = None
+
+def run_git_log(repo_path, revisions=None):
     """
-    Executes git log to retrieve commit history in the specified repo path.
+    Starts git log to stream commit history from the specified repo path,
+    optionally limited to a revision range such as "<sha>..HEAD".
+    Returns the running process, read its stdout line by line.
     """
     cmd = [
         "git",
         "log",
         "--reverse",
-        "--pretty=format:%H|%at|%aN|%s",
+        "-z", # NUL-terminate fields and file names
+        "--pretty=format:COMMIT%x00%H%x00%at%x00%aN%x00%s",
         "--name-only",
         "--no-merges"
     ]
+    if revisions:
+        cmd.append(revisions)
     
     try:
-        # Run git command
-        result = subprocess.run(cmd, cwd=repo_path, capture_output=True, text=True, encoding='utf-8', errors='replace')
-        if result.returncode != 0:
-            print(f"Error executing git log: {result.stderr}")
-            sys.exit(1)
-        return result.stdout
+        # Run git command, errors go straight to our stderr.
+        # Binary pipe: parse_log splits on NUL and decodes only what it needs.
+        return subprocess.Popen(cmd, cwd=repo_path, stdout=subprocess.PIPE)
     except Exception as e:
         print(f"Failed to run git log: {e}")
         sys.exit(1)
 
+RepoInfo = namedtuple("RepoInfo", ["head", "toplevel", "gitdir"])
+
+def resolve_repo_info(repo_path):
+    """
+    Resolves the HEAD sha, work tree top level and git dir with a single
+    git rev-parse. head is None without commits and toplevel is None outside a
+    work tree (bare repos, inside .git); returns None if repo_path isn't inside a
+    git repository.
+    """
+    cmd = [
+        "git",
+        "rev-parse",
+        "--is-inside-work-tree",
+        "--absolute-git-dir",
+        "--show-cdup",     # Only prints a line inside a work tree, unlike --show-toplevel which fails
+        "--verify", "-q",  # Missing HEAD exits 1 after the other lines instead of erroring
+        "HEAD"
+    ]
+    try:
+        result = subprocess.run(cmd, cwd=repo_path, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+    lines = result.stdout.decode('utf-8', 'replace').splitlines()
+    if result.returncode not in (0, 1) or len(lines) < 2:
+        return None
+
+    in_work_tree = lines[0] == "true"
+    gitdir = lines[1]
+    rest = lines[2:]
+    toplevel = None
+    if in_work_tree:
+        toplevel = os.path.normpath(os.path.join(os.path.abspath(repo_path), rest.pop(0)))
+    head = rest[0] if result.returncode == 0 and rest else None
+    return RepoInfo(head, toplevel, gitdir)
+
 def clone_repo(url, temp_dir):
     """
     Clones the repo metadata only (partial clone) to temp_dir.
@@ -40,8 +109,9 @@ def clone_repo(url, temp_dir):
     cmd = [
         "git",
         "clone",
+        "--bare",             # No working tree or index, git log runs on the bare repo
+        "--single-branch",    # Only the default branch's history is analyzed
         "--filter=blob:none", # Don't download file contents
-        "--no-checkout",      # Don't check out files to disk
         url,
         temp_dir
     ]
@@ -51,136 +121,570 @@ def clone_repo(url, temp_dir):
         print(f"Failed to clone repo: {e}")
         sys.exit(1)
 
-def parse_log(log_output):
+def on_rm_error(func, path, exc_info):
+    # Pack files are read-only and Windows refuses to delete them as they are
+    os.chmod(path, 0o777)
+    try:
+        func(path)
+    except Exception:
+        pass
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        on_rm_error(os.unlink, path, None)
+
+def remove_tree(path):
     """
-    Parses the git log output into a structured format.
+    Deletes a clone directory. Files are unlinked from a thread pool, since the
+    object store of a big clone can hold a very large number of them.
+    """
+    if os.name == "nt":
+        # cmd's rmdir is much faster than walking the tree from Python
+        subprocess.run(["cmd", "/c", "rmdir", "/S", "/Q", path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if not os.path.exists(path):
+            return
+
+    files = []
+    dirs = []
+    for root, dirnames, filenames in os.walk(path):
+        dirs.append(root)
+        files.extend(os.path.join(root, name) for name in filenames)
+        # Symlinked directories aren't walked into, they are removed like files
+        files.extend(os.path.join(root, name) for name in dirnames if os.path.islink(os.path.join(root, name)))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        executor.map(_unlink, files)
+    # Top-down walk order reversed: every directory is empty by the time it's removed
+    for d in reversed(dirs):
+        try:
+            os.rmdir(d)
+        except OSError:
+            on_rm_error(os.rmdir, d, None)
+
+    if os.path.exists(path):
+        # Something was left behind, let rmtree have a last go at it
+        shutil.rmtree(path, onerror=on_rm_error)
+
+def iter_tokens(stream, chunk_size=1 << 16):
+    """
+    Splits a binary stream on NUL bytes, yielding each token as it completes.
+    """
+    rest = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        tokens = (rest + chunk).split(b'\0')
+        rest = tokens.pop()
+        yield from tokens
+    if rest:
+        yield rest
+
+def parse_log(stream):
+    """
+    Parses `git log -z` output into a stream of structured commits.
+
+    Each record is COMMIT, hash, timestamp, author and subject, one NUL-terminated
+    token each. The subject is followed by a newline and the NUL-terminated file
+    names, and an empty token closes the list. A commit without files has no
+    newline after its subject. Headers are only expected where this structure puts
+    them, so a file that happens to be named COMMIT is still read as a file.
     """
-    commits = []
     current_commit = None
-    
-    lines = log_output.strip().split('\n')
-    for line in lines:
-        line = line.strip()
-        if not line:
+    files = None # current_commit's file list while its names are being read
+    path_cache = {} # raw path -> decoded str, each unique path is decoded once
+
+    tokens = iter_tokens(stream)
+    for token in tokens:
+        if files is not None:
+            # Fast path: file names far outnumber headers, handle them inline
+            if token:
+                path = path_cache.get(token)
+                if path is None:
+                    path = path_cache[token] = token.decode('utf-8', 'replace')
+                files.append(path)
+            else:
+                # End of the file list, the next token starts a record
+                files = None
+            continue
+
+        if token != b'COMMIT':
+            # Nothing but a header can follow a finished record
             continue
+
+        # New commit header, the previous commit has all its files now
+        if current_commit:
+            yield current_commit
+
+        commit_hash = next(tokens)
+        timestamp = next(tokens)
+        author = next(tokens)
+        subject, newline, first_file = next(tokens).partition(b'\n')
+        
+        current_commit = {
+            "hash": commit_hash.decode('ascii'),
+            "timestamp": int(timestamp),
+            "author": sys.intern(author.decode('utf-8', 'replace')), # few distinct authors
+            "subject": subject.decode('utf-8', 'replace'),
+            "files": []
+        }
+        if newline:
+            files = current_commit["files"]
+            if first_file:
+                path = path_cache.get(first_file)
+                if path is None:
+                    path = path_cache[first_file] = first_file.decode('utf-8', 'replace')
+                files.append(path)
+                
+    if current_commit:
+        yield current_commit
+
+def walk_commits(repo_path, base=None):
+    """
+    Walks the history with libgit2, yielding the same commits as parse_log over
+    run_git_log: oldest first, no merges, paths changed against the first parent.
+    With base, commits reachable from it are left out (like "<base>..HEAD").
+    """
+    repo = pygit2.Repository(repo_path)
+    mailmap = pygit2.Mailmap.from_repository(repo) # git log's %aN applies .mailmap
+    path_cache = {} # path -> interned path, shared by every commit touching it
+
+    walker = repo.walk(
+        repo.head.target, pygit2.GIT_SORT_TOPOLOGICAL | pygit2.GIT_SORT_TIME | pygit2.GIT_SORT_REVERSE
+    )
+    if base:
+        walker.hide(base)
+
+    for commit in walker:
+        parents = commit.parents
+        if len(parents) > 1:
+            continue
+        if parents:
+            diff = repo.diff(parents[0], commit)
+            # git log reports a renamed file under its new name only
+            diff.find_similar(pygit2.GIT_DIFF_FIND_RENAMES)
+        else:
+            # Root commit, everything in its tree is new
+            diff = commit.tree.diff_to_tree(swap=True)
+
+        files = []
+        for delta in diff.deltas:
+            path = delta.new_file.path
+            files.append(path_cache.setdefault(path, sys.intern(path)))
+
+        author = mailmap.resolve_signature(commit.author)
+        yield {
+            "hash": str(commit.id),
+            "timestamp": commit.author.time,
+            "author": sys.intern(author.name),
+            "subject": commit.message.partition('\n')[0],
+            "files": files
+        }
+
+class FileMeta:
+    """
+    Per-file node data. Slots instead of a dict per file keeps large repos compact.
+    """
+    __slots__ = ('id', 'label', 'type', 'size', 'createdAt', 'owner')
+
+    def __init__(self, id, label, type, size, createdAt, owner):
+        self.id = id
+        self.label = label
+        self.type = type
+        self.size = size # churn
+        self.createdAt = createdAt
+        self.owner = owner
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in FileMeta.__slots__}
+
+# Coupling keys pack a pair of file ids into one int: (low_id << PAIR_ID_SHIFT) | high_id
+PAIR_ID_SHIFT = 32
+PAIR_ID_BASE = 1 << PAIR_ID_SHIFT
+# Below this many files per commit, ordering each pair beats sorting the ids first
+SORT_MIN_FILES = 8
+# Pairs counted for each commit that is over the sampling threshold
+SAMPLED_PAIRS = 10_000
+
+def count_couplings(commit_rows, file_ids, n_rows, n_files):
+    """
+    Counts co-changes from flat (commit row, file id) incidence arrays.
+    With M the commits x files incidence matrix, (M.T @ M)[a, b] is the number
+    of commits touching both a and b; its strict upper triangle is the coupling.
+    """
+    rows = np.frombuffer(commit_rows, dtype=np.int32)
+    cols = np.frombuffer(file_ids, dtype=np.int32)
+    m = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+        shape=(n_rows, n_files)
+    )
+    co = (m.T @ m).tocoo()
+    upper = co.row < co.col
+    keys = co.row[upper].astype(np.int64) * PAIR_ID_BASE + co.col[upper]
+    return Counter(dict(zip(keys.tolist(), co.data[upper].tolist())))
+
+def analyze_history(commits, max_files_per_commit=None, min_churn=1, min_coupling=1, sample_above=None):
+    """
+    Calculates churn and coupling.
+    Commits touching more than max_files_per_commit files still count towards
+    churn but are left out of coupling (mass renames, vendoring, ...).
+    Commits touching more than sample_above files only count a random sample of
+    SAMPLED_PAIRS pairs, each weighted for the pairs it stands in for.
+    Only files changed in at least min_churn commits are coupled, and only pairs
+    changed together at least min_coupling times are kept.
+
+    Sampling is decided on and drawn from a commit's full file list, before the
+    churn filter, and is seeded by the commit hash. The result is therefore the
+    same as analyzing without thresholds and applying filter_couplings afterwards,
+    which is what the cached and --jobs paths do.
+    """
+    file_metadata = {} # path -> FileMeta
+    path_ids = {} # path -> int id, ids follow file_metadata insertion order
+    id_paths = [] # int id -> path
+    couplings = Counter() # packed (idA, idB) -> count, idA < idB
+
+    # Sparse path: one (commit row, file id) entry per coupled file, counted at the end
+    vectorized = sparse is not None
+    commit_rows = array('i')
+    file_ids = array('i')
+    n_rows = 0
+
+    sampled = Counter() # packed (idA, idB) -> estimated count from sampled commits
+
+    def commit_ids():
+        # Yields (hash, file ids) of each commit that takes part in coupling
+        for commit in commits:
+            files = commit["files"]
+            timestamp = commit["timestamp"]
+            author = commit["author"]
             
-        if '|' in line and len(line.split('|')) >= 3:
-            # New commit header
-            parts = line.split('|')
-            commit_hash = parts[0]
-            timestamp = int(parts[1])
-            author = parts[2]
-            subject = parts[3] if len(parts) > 3 else ""
+            # Churn and Metadata (deduped so each file counts once per commit).
+            # dict.fromkeys keeps git's path order, so ids (and with them node order
+            # and pair sampling) don't depend on PYTHONHASHSEED
+            ids = []
+            for f in dict.fromkeys(files):
+                if f not in file_metadata:
+                    path_ids[f] = len(path_ids)
+                    id_paths.append(f)
+                    file_metadata[f] = FileMeta(
+                        id=f,
+                        label=os.path.basename(f),
+                        type=get_file_type(f),
+                        size=1, # Initial size/churn
+                        createdAt=timestamp,
+                        owner=author
+                    )
+                else:
+                    file_metadata[f].size += 1
+                ids.append(path_ids[f])
             
-            current_commit = {
-                "hash": commit_hash,
-                "timestamp": timestamp,
-                "author": author,
-                "subject": subject,
-                "files": []
-            }
-            commits.append(current_commit)
+            if len(ids) >= 2 and not (max_files_per_commit and len(ids) > max_files_per_commit):
+                yield commit["hash"], ids
+
+    groups = commit_ids()
+    hot = None
+    if min_churn > 1:
+        # Churn has to be final before pairing, so the first pass runs to the end
+        # (keeping just the id lists) and rarely changed files are dropped before
+        # any pairs are enumerated for them
+        groups = list(groups)
+        hot = [meta.size >= min_churn for meta in file_metadata.values()]
+
+    for commit_hash, ids in groups:
+        total = len(ids) * (len(ids) - 1) // 2
+        if sample_above and len(ids) > sample_above and total > SAMPLED_PAIRS:
+            # Seeded per commit and drawn over the paths in sorted order, the sample
+            # doesn't depend on which other commits are analyzed in the same call
+            # (cache deltas, --jobs slices), whose ids would differ
+            ids.sort(key=id_paths.__getitem__)
+            rng = random.Random(commit_hash)
+            # Integer weights adding up to exactly total, so results merge exactly
+            weight, extra = divmod(total, SAMPLED_PAIRS)
+            for n, p in enumerate(rng.sample(range(total), SAMPLED_PAIRS)):
+                # Pair index p = j * (j - 1) / 2 + i, with i < j
+                j = (1 + math.isqrt(1 + 8 * p)) // 2
+                i = p - j * (j - 1) // 2
+                a, b = ids[i], ids[j]
+                if a > b:
+                    a, b = b, a
+                if hot is None or (hot[a] and hot[b]):
+                    sampled[(a << PAIR_ID_SHIFT) | b] += (weight + 1) if n < extra else weight
+            continue
+
+        if hot is not None:
+            ids = [i for i in ids if hot[i]]
+            if len(ids) < 2:
+                continue
+
+        if vectorized:
+            commit_rows.extend([n_rows] * len(ids))
+            file_ids.extend(ids)
+            n_rows += 1
+            continue
+
+        # Coupling: canonical (low, high) pairs, packed into a single int key
+        # instead of a tuple of two
+        if len(ids) < SORT_MIN_FILES:
+            couplings.update([
+                (a << PAIR_ID_SHIFT) | b if a < b else (b << PAIR_ID_SHIFT) | a
+                for a, b in itertools.combinations(ids, 2)
+            ])
         else:
-            # File path
-            if current_commit:
-                current_commit["files"].append(line)
-                
-    return commits
+            ids.sort()
+            couplings.update([(a << PAIR_ID_SHIFT) | b for a, b in itertools.combinations(ids, 2)])
+
+    if vectorized:
+        couplings = count_couplings(commit_rows, file_ids, n_rows, len(path_ids))
+    couplings.update(sampled)
+    if min_coupling > 1:
+        couplings = Counter({key: weight for key, weight in couplings.items() if weight >= min_coupling})
 
-def analyze_history(commits):
+    return file_metadata, couplings
+
+def merge_history(results):
     """
-    Calculates churn and coupling.
+    Merges analyze_history results of consecutive slices of history, oldest first.
+    Churn adds up; createdAt and owner come from the slice that saw a file first.
     """
-    file_metadata = {} # path -> {createdAt, size(churn), owner}
-    couplings = Counter() # (fileA, fileB) -> count
+    file_metadata = {}
+    path_ids = {}
+    couplings = Counter()
     
-    for commit in commits:
-        files = commit["files"]
-        timestamp = commit["timestamp"]
-        author = commit["author"]
-        
-        # Sort files to ensure consistent key for couplings
-        files.sort()
-        
-        # Churn and Metadata
-        for f in files:
+    for chunk_metadata, chunk_couplings in results:
+        # Map the slice's file ids (its insertion order) to merged ids
+        remap = []
+        for f, meta in chunk_metadata.items():
             if f not in file_metadata:
-                file_metadata[f] = {
-                    "id": f,
-                    "label": os.path.basename(f),
-                    "type": get_file_type(f),
-                    "size": 1, # Initial size/churn
-                    "createdAt": timestamp,
-                    "owner": author
-                }
+                path_ids[f] = len(path_ids)
+                file_metadata[f] = meta
             else:
-                file_metadata[f]["size"] += 1
+                file_metadata[f].size += meta.size
+            remap.append(path_ids[f])
         
-        # Coupling
-        if len(files) > 1:
-            for i in range(len(files)):
-                for j in range(i + 1, len(files)):
-                    f1 = files[i]
-                    f2 = files[j]
-                    couplings[(f1, f2)] += 1
+        for key, weight in chunk_couplings.items():
+            a, b = divmod(key, PAIR_ID_BASE)
+            a, b = remap[a], remap[b]
+            if a > b:
+                a, b = b, a
+            couplings[a * PAIR_ID_BASE + b] += weight
+
+    return file_metadata, couplings
 
+def filter_couplings(file_metadata, couplings, min_churn=1, min_coupling=1):
+    """
+    Applies analyze_history's min_churn/min_coupling thresholds to a finished
+    result, for results that had to be computed in full (merged or cached ones).
+    """
+    if min_churn <= 1 and min_coupling <= 1:
+        return couplings
+    churn = [meta.size for meta in file_metadata.values()]
+    low_mask = PAIR_ID_BASE - 1
+    return Counter({
+        key: weight for key, weight in couplings.items()
+        if weight >= min_coupling
+        and churn[key >> PAIR_ID_SHIFT] >= min_churn
+        and churn[key & low_mask] >= min_churn
+    })
+
+def analyze_parallel(commits, jobs, **options):
+    """
+    Runs analyze_history on `jobs` contiguous slices of the history in worker
+    processes (threads wouldn't help, the work is GIL-bound) and merges the results.
+    """
+    commits = list(commits)
+    size = max(1, -(-len(commits) // jobs))
+    chunks = [commits[i:i + size] for i in range(0, len(commits), size)]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return merge_history(executor.map(functools.partial(analyze_history, **options), chunks))
+
+# Analysis results are cached per HEAD sha, so re-runs only parse new commits.
+# The cache lives in a per-user directory rather than the working tree: a repo
+# could otherwise ship its own pickles there and have us load them.
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "obsidigit"
+)
+CACHE_VERSION = 3
+# Each entry is a full result, only the most recently used few are kept
+CACHE_MAX_ENTRIES = 4
+
+def get_cache_path(sha):
+    return os.path.join(CACHE_DIR, f"{sha}.pkl")
+
+def find_cached_ancestor(repo_path):
+    """
+    Returns the newest commit reachable from HEAD that has a cached result, or None.
+    """
+    try:
+        cached = {name[:-4] for name in os.listdir(CACHE_DIR) if name.endswith(".pkl")}
+    except OSError:
+        return None
+    if not cached:
+        return None
+
+    # rev-list walks history newest first without diffing trees, much cheaper than git log
+    proc = subprocess.Popen(["git", "rev-list", "HEAD"], cwd=repo_path, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        for line in proc.stdout:
+            sha = line.decode('ascii').strip()
+            if sha in cached:
+                return sha
+        return None
+    finally:
+        proc.kill()
+        proc.stdout.close()
+        proc.wait()
+
+def load_cache(sha, options):
+    """
+    Loads the cached (file_metadata, couplings) for a commit, or None if there is
+    no usable entry (missing, unreadable or computed with other options).
+    """
+    try:
+        with open(get_cache_path(sha), "rb") as f:
+            entry = pickle.load(f)
+        if not isinstance(entry, dict) or entry.get("version") != CACHE_VERSION or entry.get("options") != options:
+            return None
+        file_metadata, couplings = entry["file_metadata"], entry["couplings"]
+        if not isinstance(file_metadata, dict) or not isinstance(couplings, dict):
+            return None
+    except Exception:
+        return None
+    try:
+        # Mark as recently used so trim_cache keeps it
+        os.utime(get_cache_path(sha))
+    except OSError:
+        pass
     return file_metadata, couplings
 
+def save_cache(sha, options, file_metadata, couplings):
+    """
+    Writes the result for a commit to the cache atomically.
+    """
+    entry = {
+        "version": CACHE_VERSION,
+        "options": options,
+        "file_metadata": file_metadata,
+        "couplings": couplings
+    }
+    try:
+        # Private to the user, nobody else gets to plant entries for us to unpickle
+        os.makedirs(CACHE_DIR, mode=0o700, exist_ok=True)
+        # Write to a temp file and rename so readers never see a partial pickle
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, get_cache_path(sha))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        print(f"Could not write cache: {e}")
+
+def trim_cache():
+    """
+    Deletes all but the CACHE_MAX_ENTRIES most recently used cache entries.
+    """
+    try:
+        entries = []
+        for entry in os.scandir(CACHE_DIR):
+            if entry.name.endswith(".pkl"):
+                entries.append((entry.stat().st_mtime, entry.path))
+        for _, path in sorted(entries, reverse=True)[CACHE_MAX_ENTRIES:]:
+            os.remove(path)
+    except OSError as e:
+        print(f"Cache trim error: {e}")
+
+_EXT_MAP = {
+    'py': 'PYTHON',
+    'js': 'JS',
+    'html': 'HTML',
+    'css': 'CSS',
+    'json': 'JSON',
+    'md': 'DOCS',
+    'txt': 'TEXT',
+    'c': 'C',
+    'cpp': 'CPP',
+    'h': 'HEADER',
+    'java': 'JAVA',
+    'go': 'GO',
+    'rs': 'RUST',
+    'ts': 'TS',
+    'jsx': 'REACT',
+    'tsx': 'REACT'
+}
+
+@functools.lru_cache(maxsize=64)
+def _type_for_ext(ext):
+    """
+    Maps a (case-insensitive) extension, without the dot, to its file type.
+    """
+    return _EXT_MAP.get(ext.lower(), 'OTHER')
+
 def get_file_type(filepath):
     """
     Determines file type based on extension.
     """
-    ext = os.path.splitext(filepath)[1].lower()
-    mapping = {
-        '.py': 'PYTHON',
-        '.js': 'JS',
-        '.html': 'HTML',
-        '.css': 'CSS',
-        '.json': 'JSON',
-        '.md': 'DOCS',
-        '.txt': 'TEXT',
-        '.c': 'C',
-        '.cpp': 'CPP',
-        '.h': 'HEADER',
-        '.java': 'JAVA',
-        '.go': 'GO',
-        '.rs': 'RUST',
-        '.ts': 'TS',
-        '.jsx': 'REACT',
-        '.tsx': 'REACT'
-    }
-    return mapping.get(ext, 'OTHER')
+    # Same rules as os.path.splitext: the extension comes from the basename only
+    # and leading dots (.gitignore) don't start one
+    stem, dot, ext = filepath.rpartition('/')[2].rpartition('.')
+    if not dot or not stem.lstrip('.'):
+        return 'OTHER'
+    return _type_for_ext(ext)
 
-def generate_json(file_metadata, couplings):
+def write_json(file_metadata, couplings, f):
     """
-    Generates the final JSON structure.
+    Writes the final JSON structure to a binary file as compact JSON, encoding
+    each node and link as it is reached instead of building the whole document first.
     """
     nodes = list(file_metadata.values())
-    links = []
-    
-    for pair, weight in couplings.items():
-        source, target = pair
-        if source in file_metadata and target in file_metadata:
-            link_time = max(file_metadata[source]["createdAt"], file_metadata[target]["createdAt"])
-            links.append({
-                "source": source,
-                "target": target,
-                "weight": weight,
-                "createdAt": link_time
-            })
-            
-    return {
-        "nodes": nodes,
-        "links": links
-    }
+
+    f.write(b'{"nodes":[')
+    sep = b''
+    for node in nodes:
+        f.write(sep)
+        f.write(dumps(node.to_dict()))
+        sep = b','
+
+    f.write(b'],"links":[')
+    sep = b''
+    # Coupling ids index file_metadata in insertion order
+    for key, weight in couplings.items():
+        source_id, target_id = divmod(key, PAIR_ID_BASE)
+        source = nodes[source_id]
+        target = nodes[target_id]
+        link_time = max(source.createdAt, target.createdAt)
+        f.write(sep)
+        f.write(dumps({
+            "source": source.id,
+            "target": target.id,
+            "weight": weight,
+            "createdAt": link_time
+        }))
+        sep = b','
+    f.write(b']}')
 
 def main():
     parser = argparse.ArgumentParser(description="Visualize Git Evolution")
     parser.add_argument("repo_url", nargs="?", help="Optional URL of a remote git repository to analyze")
+    parser.add_argument("--max-files-per-commit", type=int, default=None, help="Leave commits touching more files than this out of coupling")
+    parser.add_argument("--jobs", type=int, default=1, help=f"Analyze history in N worker processes (e.g. {os.cpu_count()} on this machine)")
+    parser.add_argument("--min-churn", type=int, default=1, help="Only couple files changed in at least this many commits")
+    parser.add_argument("--min-coupling", type=int, default=1, help="Only keep file pairs changed together at least this many times")
+    parser.add_argument("--sample-above", type=int, default=None, help=f"Only count a sample of {SAMPLED_PAIRS} pairs for commits touching more files than this")
+    parser.add_argument("--no-cache", action="store_true", help=f"Don't read or write cached results in {CACHE_DIR}/")
     args = parser.parse_args()
 
     repo_path = os.getcwd()
     temp_dir = None
+    # Options that change analyze_history's result, cached results must match them
+    options = {
+        "max_files_per_commit": args.max_files_per_commit,
+        "sample_above": args.sample_above
+    }
 
     if args.repo_url:
         temp_dir = tempfile.mkdtemp()
@@ -188,37 +692,80 @@ def main():
         repo_path = temp_dir
     
     try:
-        print(f"Fetching git history from {repo_path}...")
-        log_output = run_git_log(repo_path)
-        
-        print(f"Parsing {len(log_output.splitlines())} lines of log...")
-        commits = parse_log(log_output)
-        print(f"Found {len(commits)} commits.")
-        
-        print("Analyzing evolution...")
-        file_metadata, couplings = analyze_history(commits)
+        info = resolve_repo_info(repo_path)
+        if info:
+            # Report the repository root even when run from a subdirectory
+            repo_path = info.toplevel or info.gitdir
+        head = info.head if info and not args.no_cache else None
+        cached = load_cache(head, options) if head else None
+        base = None
+        # The thresholds can only be applied during analysis when the result is
+        # final; results that get cached or merged are kept whole and filtered after
+        prefilter = not head and args.jobs == 1
+        if cached:
+            print(f"Using cached analysis for {head}")
+            file_metadata, couplings = cached
+        else:
+            # An older cached commit means only the commits since need analyzing
+            base = find_cached_ancestor(repo_path) if head else None
+            cached = load_cache(base, options) if base else None
+            revisions = f"{base}..HEAD" if cached else None
+
+            if cached:
+                print(f"Fetching and analyzing git history from {repo_path} since {base}...")
+            else:
+                print(f"Fetching and analyzing git history from {repo_path}...")
+            proc = None
+            if pygit2 is not None and not temp_dir:
+                # libgit2 can't fetch objects a partial clone left out, so clones
+                # always go through git log
+                commits = walk_commits(info.gitdir if info else repo_path, base if cached else None)
+            else:
+                proc = run_git_log(repo_path, revisions)
+                # Commits are parsed and analyzed as git streams them, the full log
+                # is never held in memory (except to split it up for --jobs)
+                commits = parse_log(proc.stdout)
+            try:
+                if args.jobs > 1:
+                    file_metadata, couplings = analyze_parallel(commits, args.jobs, **options)
+                elif prefilter:
+                    file_metadata, couplings = analyze_history(
+                        commits, min_churn=args.min_churn, min_coupling=args.min_coupling, **options
+                    )
+                else:
+                    file_metadata, couplings = analyze_history(commits, **options)
+            except PYGIT2_ERRORS as e:
+                print(f"Error reading git history: {e}")
+                sys.exit(1)
+            finally:
+                if proc:
+                    proc.stdout.close()
+                    proc.wait()
+            if proc and proc.returncode != 0:
+                print(f"Error executing git log (exit code {proc.returncode})")
+                sys.exit(1)
+
+            if cached:
+                # Fold the new commits into the cached result, which is older
+                file_metadata, couplings = merge_history([cached, (file_metadata, couplings)])
+            if head:
+                save_cache(head, options, file_metadata, couplings)
+                trim_cache()
+        if not prefilter:
+            couplings = filter_couplings(file_metadata, couplings, args.min_churn, args.min_coupling)
         print(f"Tracked {len(file_metadata)} files and {len(couplings)} coupled pairs.")
         
         print("Generating JSON...")
-        data = generate_json(file_metadata, couplings)
-        
         output_file = "evolution.json"
-        with open(output_file, "w") as f:
-            json.dump(data, f, indent=2)
+        with open(output_file, "wb", buffering=1 << 22) as f:
+            write_json(file_metadata, couplings, f)
             
         print(f"Done! Saved to {output_file}")
         
     finally:
         if temp_dir:
             print("Cleaning up temporary directory...")
-            # simplified cleanup
-            def on_rm_error(func, path, exc_info):
-                os.chmod(path, 0o777)
-                try:
-                    func(path)
-                except Exception:
-                    pass
-            shutil.rmtree(temp_dir, onerror=on_rm_error)
+            remove_tree(temp_dir)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,96 @@
+import io
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import git_evolution
+
+
+def make_commits():
+    rng = random.Random(7)
+    files = [f"src/f{i}.py" for i in range(400)]
+    commits = []
+    for n in range(60):
+        # Every fifth commit is oversized (>= SAMPLED_PAIRS pairs) and gets sampled
+        touched = rng.sample(files, 180 if n % 5 == 0 else rng.randint(1, 12))
+        commits.append({
+            "hash": f"{n:040x}",
+            "timestamp": 1700000000 + n,
+            "author": "Alice",
+            "subject": f"commit {n}",
+            "files": touched
+        })
+    return commits
+
+
+def as_links(file_metadata, couplings):
+    paths = list(file_metadata)
+    return {
+        (paths[key >> git_evolution.PAIR_ID_SHIFT], paths[key & (git_evolution.PAIR_ID_BASE - 1)]): weight
+        for key, weight in couplings.items()
+    }
+
+
+@pytest.mark.parametrize("vectorized", [True, False])
+def test_thresholds_match_between_prefiltered_and_merged_paths(monkeypatch, vectorized):
+    if not vectorized:
+        monkeypatch.setattr(git_evolution, "sparse", None)
+    commits = make_commits()
+    options = {"sample_above": 100}
+
+    # No cache, single process: thresholds applied during analysis
+    direct = git_evolution.analyze_history(commits, min_churn=3, min_coupling=2, **options)
+
+    # Cache / --jobs: slices analyzed in full, merged, then filtered
+    merged_metadata, merged_couplings = git_evolution.merge_history([
+        git_evolution.analyze_history(commits[:23], **options),
+        git_evolution.analyze_history(commits[23:], **options),
+    ])
+    merged_couplings = git_evolution.filter_couplings(merged_metadata, merged_couplings, 3, 2)
+
+    assert as_links(*direct) == as_links(merged_metadata, merged_couplings)
+    assert direct[1]
+
+
+def parse(raw):
+    return list(git_evolution.parse_log(io.BytesIO(raw)))
+
+
+def test_parse_log_reads_a_file_named_commit_as_a_file():
+    commits = parse(
+        b"COMMIT\0" + b"a" * 40 + b"\0" + b"1700000000\0Alice\0add files\nCOMMIT\0src/x.py\0\0"
+        b"COMMIT\0" + b"b" * 40 + b"\0" + b"1700000001\0Bob\0edit\nCOMMIT\0"
+    )
+    assert [c["files"] for c in commits] == [["COMMIT", "src/x.py"], ["COMMIT"]]
+    assert [c["author"] for c in commits] == ["Alice", "Bob"]
+
+
+def test_parse_log_handles_commits_without_files():
+    commits = parse(
+        b"COMMIT\0" + b"a" * 40 + b"\0" + b"1700000000\0Alice\0first\na.py\0\0"
+        b"COMMIT\0" + b"b" * 40 + b"\0" + b"1700000001\0Bob\0empty\0"
+        b"COMMIT\0" + b"c" * 40 + b"\0" + b"1700000002\0Carol\0last\nb.py\0"
+    )
+    assert [(c["subject"], c["files"]) for c in commits] == [
+        ("first", ["a.py"]),
+        ("empty", []),
+        ("last", ["b.py"]),
+    ]
+    assert commits[1]["hash"] == "b" * 40
+    assert commits[1]["timestamp"] == 1700000001
+
+
+def test_parse_log_keeps_pipes_in_subjects_and_paths():
+    commits = parse(
+        b"COMMIT\0" + b"a" * 40 + b"\0" + b"1700000000\0Alice\0fix a | b\ndocs/a|b.md\0c.py\0"
+    )
+    assert commits == [{
+        "hash": "a" * 40,
+        "timestamp": 1700000000,
+        "author": "Alice",
+        "subject": "fix a | b",
+        "files": ["docs/a|b.md", "c.py"],
+    }]